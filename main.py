@@ -1,16 +1,43 @@
+import asyncio
+import hashlib
 import io
 import logging
 import os  # ADD THIS IMPORT
 import signal
 import sys
+from collections import OrderedDict, deque
+from pathlib import Path
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Optional, Union
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
-from PIL import Image
-from rembg import remove, new_session
+from starlette.background import BackgroundTask
+# The multipart parser yields Starlette's UploadFile (FastAPI's is a
+# subclass, so an isinstance check against it would always fail here)
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from PIL import Image, ImageOps
+from rembg.sessions.u2netp import U2netpSession
+
+import numpy as np
+import onnxruntime as ort
+
+# Fast SIMD PNG encoder; optional — Pillow remains the fallback.
+# (pyspng was tried here first, but the stock PyPI build is decode-only)
+try:
+    import fpnge
+    if not hasattr(fpnge, "fromNP"):  # guard against API-less builds
+        fpnge = None
+except ImportError:
+    fpnge = None
+
+# Native OpenVINO runtime; optional — used for CPU-only hosts
+try:
+    import openvino as ov
+except ImportError:
+    ov = None
 
 # Added imports for memory handling
 import torch
@@ -29,51 +56,454 @@ logger = logging.getLogger(__name__)
 # Global model session (loaded once at startup)
 model_session: Optional[object] = None
 
+# Global batching queue in front of the ONNX session (started in lifespan)
+batch_queue: Optional["AsyncBatchQueue"] = None
+
 # Configuration
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Batching: coalesce up to this many concurrent requests into one
+# session.run, waiting at most BATCH_MAX_WAIT for stragglers
+MAX_BATCH_SIZE = 8
+BATCH_MAX_WAIT = 0.010  # 10ms
+
+# Result cache bounds (entries and total payload bytes). The cache is
+# per process, so split the 256MB budget across server workers — with
+# WEB_CONCURRENCY=4 an unscaled cap would mean up to 1GB of duplicated
+# cache inside the container's memory limit
+_SERVER_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+CACHE_MAX_ENTRIES = max(1, 256 // _SERVER_WORKERS)
+CACHE_MAX_BYTES = 256 * 1024 * 1024 // _SERVER_WORKERS
+
+# Response streaming chunk size
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+# Pooled PNG output buffers start at this capacity
+BUFFER_INITIAL_SIZE = 2 * 1024 * 1024  # 2MB
+
+# Model input resolution for u2netp (fixed by the network architecture)
+MODEL_INPUT_SIZE = (320, 320)
+
+# ImageNet normalization used by the u2netp preprocessor
+MODEL_MEAN = np.array((0.485, 0.456, 0.406), dtype=np.float32)
+MODEL_STD = np.array((0.229, 0.224, 0.225), dtype=np.float32)
+
 # Expanded list of supported image formats (PIL/Pillow supported)
-ALLOWED_EXTENSIONS = {
+ALLOWED_EXTENSIONS = frozenset({
     "image/jpeg", "image/jpg", "image/png", "image/gif",
     "image/bmp", "image/tiff", "image/webp", "image/x-icon",
     "image/vnd.microsoft.icon", "image/avif", "image/heic",
     "image/heif", "image/x-tga", "image/x-pcx", "image/x-portable-pixmap",
     "image/x-portable-graymap", "image/x-portable-bitmap",
     "image/x-portable-anymap", "image/x-ms-bmp"
+})
+
+# Accepted filename suffixes; str.endswith takes the tuple directly
+# (single C call — no per-extension Python loop on the hot path)
+_ALLOWED_SUFFIXES = (
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff',
+    '.tif', '.webp', '.ico', '.avif', '.heic', '.heif',
+    '.tga', '.pcx', '.ppm', '.pgm', '.pbm', '.pnm'
+)
+
+
+class QuantizedU2netpSession(U2netpSession):
+    """
+    u2netp session backed by an INT8 dynamically-quantized model.
+
+    Quantizes the downloaded FP32 ONNX once (cached next to it) — halves
+    memory bandwidth and speeds up the convolutions on VNNI-capable CPUs.
+    """
+
+    @classmethod
+    def download_models(cls, *args, **kwargs):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        fp32_path = Path(super().download_models(*args, **kwargs))
+        int8_path = fp32_path.with_name("u2netp_int8.onnx")
+        if not int8_path.exists():
+            logger.info("⚙️ Quantizing u2netp to INT8 (one-time)...")
+            quantize_dynamic(
+                str(fp32_path),
+                str(int8_path),
+                weight_type=QuantType.QUInt8,
+            )
+            logger.info("✅ INT8 model written")
+        return str(int8_path)
+
+
+class OpenVINOU2netpSession(U2netpSession):
+    """
+    u2netp compiled with native OpenVINO in THROUGHPUT mode.
+
+    The THROUGHPUT performance hint lets the OV runtime run several
+    inference streams in parallel, saturating all cores even when the
+    batch queue only ever sees single requests. Requests go through an
+    AsyncInferQueue; completions are bridged back to asyncio futures.
+    """
+
+    def __init__(self, model_name: str = "u2netp", *args, **kwargs):
+        # Deliberately no super().__init__(): there is no ORT session here
+        self.model_name = model_name
+        core = ov.Core()
+        model = core.read_model(str(self.__class__.download_models(*args, **kwargs)))
+        self._compiled = core.compile_model(model, "CPU", {"PERFORMANCE_HINT": "THROUGHPUT"})
+        self._output = self._compiled.output(0)
+        self._infer_queue = ov.AsyncInferQueue(self._compiled, os.cpu_count() or 1)
+        self._infer_queue.set_callback(self._complete)
+
+    @staticmethod
+    def _complete(infer_request, userdata) -> None:
+        loop, future = userdata
+        result = infer_request.get_output_tensor(0).data.copy()
+
+        def _resolve():
+            if not future.done():
+                future.set_result(result)
+
+        loop.call_soon_threadsafe(_resolve)
+
+    async def run_batch(self, stacked: np.ndarray) -> np.ndarray:
+        """
+        Run a stacked NCHW batch as parallel single-image jobs on the
+        infer queue (the compiled graph has a fixed batch dim of 1;
+        THROUGHPUT streams give the parallelism instead).
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for i in range(stacked.shape[0]):
+            future = loop.create_future()
+            # start_async blocks while the queue is full — keep that
+            # wait off the event loop
+            await asyncio.to_thread(
+                self._infer_queue.start_async, stacked[i:i + 1], (loop, future)
+            )
+            futures.append(future)
+        preds = await asyncio.gather(*futures)
+        return np.concatenate(preds, axis=0)
+
+    def predict(self, img: Image.Image) -> list:
+        """
+        Single-image synchronous path (warm-up and non-batched fallback).
+        """
+        pred = self._compiled(preprocess_for_model(img))[self._output]
+        return [mask_from_output(pred[0], img.size)]
+
+
+def _cuda_is_usable() -> bool:
+    """
+    True when the ORT build offers the CUDA provider AND the host has a
+    CUDA driver. get_available_providers() alone only reflects what the
+    installed wheel was built with — an onnxruntime-gpu install on a
+    CPU-only host still lists CUDAExecutionProvider.
+    """
+    if "CUDAExecutionProvider" not in ort.get_available_providers():
+        return False
+    try:
+        import ctypes
+        ctypes.CDLL("nvcuda.dll" if sys.platform == "win32" else "libcuda.so.1")
+        return True
+    except OSError:
+        logger.info("CUDA provider built in, but no usable CUDA driver on this host")
+        return False
+
+
+def build_model_session() -> U2netpSession:
+    """
+    Build the inference session explicitly so we control providers
+    and optimization options instead of relying on rembg defaults.
+
+    Prefers CUDA, then native OpenVINO in THROUGHPUT mode (CPU-only
+    hosts), then the OpenVINO execution provider, then plain CPU.
+    """
+    sess_opts = ort.SessionOptions()
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    available = ort.get_available_providers()
+    if _cuda_is_usable():
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    else:
+        # CPU-only host: native OpenVINO in THROUGHPUT mode beats both
+        # the OV execution provider and plain ORT when installed
+        if ov is not None:
+            try:
+                logger.info("Building native OpenVINO session (THROUGHPUT mode)")
+                return OpenVINOU2netpSession("u2netp")
+            except Exception as e:
+                logger.warning(f"OpenVINO session unavailable ({e}); falling back to ONNX Runtime")
+
+        if "OpenVINOExecutionProvider" in available:
+            providers = ["OpenVINOExecutionProvider", "CPUExecutionProvider"]
+        else:
+            providers = ["CPUExecutionProvider"]
+            # CPU inference: split cores across server workers instead of
+            # letting every session grab all of them — concurrent requests
+            # otherwise oversubscribe the cores and thrash caches. The
+            # batching queue provides the throughput scaling.
+            sess_opts.intra_op_num_threads = max(1, (os.cpu_count() or 1) // _SERVER_WORKERS)
+            sess_opts.inter_op_num_threads = 1
+            sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+
+    logger.info(f"Building ONNX session with providers: {providers}")
+
+    # On CPU, prefer the INT8 model: quality holds up and throughput
+    # roughly doubles on VNNI hardware. GPU keeps FP32 (CUDA EP has no
+    # fast INT8 path for these ops).
+    # providers must go by keyword: BaseSession.__init__ is
+    # (model_name, sess_opts, *args, **kwargs) and only reads
+    # kwargs["providers"] — positionally it lands in *args and rembg
+    # silently re-runs its own auto-detection
+    if providers[0] == "CPUExecutionProvider":
+        try:
+            return QuantizedU2netpSession("u2netp", sess_opts, providers=providers)
+        except Exception as e:
+            logger.warning(f"INT8 quantization unavailable ({e}); using FP32 model")
+
+    return U2netpSession("u2netp", sess_opts, providers=providers)
+
+
+def _p_to_rgb(image: Image.Image) -> Image.Image:
+    """
+    Palette mode: vectorized palette lookup via fancy indexing.
+    Palettes with transparency keep the (correct) PIL conversion.
+    """
+    if 'transparency' in image.info:
+        return image.convert('RGBA')
+    palette = image.getpalette()
+    if palette is None:
+        return image.convert('RGB')
+    lut = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    if lut.shape[0] < 256:
+        # getpalette() only returns the defined entries, but pixel
+        # indices may run past them — pad with black like PIL does
+        lut = np.vstack([lut, np.zeros((256 - lut.shape[0], 3), dtype=np.uint8)])
+    idx = np.asarray(image)
+    return Image.fromarray(lut[idx], 'RGB')
+
+
+def _l_to_rgb(image: Image.Image) -> Image.Image:
+    """
+    Grayscale: broadcast the single channel to three.
+    """
+    arr = np.asarray(image)
+    return Image.fromarray(np.repeat(arr[:, :, np.newaxis], 3, axis=2), 'RGB')
+
+
+def _la_to_rgba(image: Image.Image) -> Image.Image:
+    """
+    Grayscale + alpha: broadcast gray to RGB, carry alpha over.
+    """
+    arr = np.asarray(image)
+    out = np.empty((arr.shape[0], arr.shape[1], 4), dtype=np.uint8)
+    out[:, :, :3] = arr[:, :, :1]
+    out[:, :, 3] = arr[:, :, 1]
+    return Image.fromarray(out, 'RGBA')
+
+
+def _bin_to_rgb(image: Image.Image) -> Image.Image:
+    """
+    Binary (1-bit): expand to 0/255 gray, then broadcast to RGB.
+    """
+    arr = np.asarray(image, dtype=np.uint8) * 255
+    return Image.fromarray(np.repeat(arr[:, :, np.newaxis], 3, axis=2), 'RGB')
+
+
+def _cmyk_to_rgb(image: Image.Image) -> Image.Image:
+    """
+    CMYK: leave the colorspace math to PIL.
+    """
+    return image.convert('RGB')
+
+
+def _default_to_rgb(image: Image.Image) -> Image.Image:
+    """
+    Fallback for any other exotic mode.
+    """
+    return image.convert('RGB')
+
+
+# Mode-normalization dispatch: one dict lookup instead of re-comparing
+# the mode string down an if/elif ladder on every request
+_MODE_TO_RGB = {
+    'P': _p_to_rgb,
+    'L': _l_to_rgb,
+    'LA': _la_to_rgba,
+    '1': _bin_to_rgb,
+    'CMYK': _cmyk_to_rgb,
 }
 
 
+def preprocess_for_model(image: Image.Image) -> np.ndarray:
+    """
+    Resize and normalize a PIL image into the 1x3x320x320 float32 NCHW
+    tensor u2netp expects (mirrors rembg's preprocessor).
+
+    Uses BILINEAR for the downscale: multi-megapixel uploads shrink to
+    320x320 several times faster than with LANCZOS and the saliency
+    output is indistinguishable.
+    """
+    small = image.convert("RGB").resize(MODEL_INPUT_SIZE, Image.BILINEAR)
+    arr = np.asarray(small, dtype=np.float32)
+    arr = arr / max(float(arr.max()), 1e-6)
+    arr = (arr - MODEL_MEAN) / MODEL_STD
+    return np.ascontiguousarray(arr.transpose((2, 0, 1)))[np.newaxis, ...]
+
+
+def mask_from_output(pred: np.ndarray, size: tuple) -> Image.Image:
+    """
+    Turn one model output slice (Cx320x320) into a full-size L-mode
+    alpha mask (mirrors rembg's u2netp postprocessor).
+    """
+    pred = pred[0]  # saliency channel
+    mi, ma = float(pred.min()), float(pred.max())
+    pred = (pred - mi) / max(ma - mi, 1e-6)
+    mask = Image.fromarray((pred * 255).astype(np.uint8), mode="L")
+    # BILINEAR: upscaling a smooth 320x320 saliency map gains nothing
+    # from LANCZOS and costs noticeably more on large originals
+    return mask.resize(size, Image.BILINEAR)
+
+
+class AsyncBatchQueue:
+    """
+    Coalesces concurrent inference requests into batched session.run calls.
+
+    Requests submit preprocessed NCHW tensors; a background task drains
+    up to MAX_BATCH_SIZE of them (waiting at most BATCH_MAX_WAIT for
+    stragglers), stacks them into one batch, runs it through the session,
+    and resolves each request's future with its slice of the output.
+
+    The stock u2netp ONNX is exported with a static [1,3,320,320] input,
+    so the ORT path only feeds a stacked tensor when the graph actually
+    declares a dynamic batch axis; otherwise the batch runs image by
+    image inside a single worker thread (one loop hop per batch either
+    way).
+    """
+
+    def __init__(self, session, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_time: float = BATCH_MAX_WAIT):
+        self._session = session
+        self._max_batch_size = max_batch_size
+        self._max_wait_time = max_wait_time
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, tensor: np.ndarray) -> np.ndarray:
+        """
+        Enqueue one preprocessed tensor and await its output slice.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, future))
+        return await future
+
+    @staticmethod
+    def _run_ort(inner, stacked: np.ndarray) -> np.ndarray:
+        """
+        Run a stacked batch through an ONNX Runtime session (sync — run
+        under asyncio.to_thread). Falls back to per-image runs when the
+        graph's batch axis is static.
+        """
+        model_input = inner.get_inputs()[0]
+        batch_dim = model_input.shape[0]
+        if not isinstance(batch_dim, int) or stacked.shape[0] == batch_dim:
+            # Dynamic batch axis (or exact match): one run for the lot
+            return inner.run(None, {model_input.name: stacked})[0]
+
+        # Static batch-1 graph: ORT rejects a stacked first dim, so run
+        # each image separately
+        preds = [
+            inner.run(None, {model_input.name: stacked[i:i + 1]})[0]
+            for i in range(stacked.shape[0])
+        ]
+        return np.concatenate(preds, axis=0)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first request, then collect stragglers
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait_time
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                stacked = np.concatenate([tensor for tensor, _ in batch], axis=0)
+                run_batch = getattr(self._session, "run_batch", None)
+                if run_batch is not None:
+                    # Backend with its own batched/parallel entry point
+                    # (e.g. the OpenVINO THROUGHPUT session)
+                    preds = await run_batch(stacked)
+                else:
+                    # Run inference off the event loop
+                    preds = await asyncio.to_thread(
+                        self._run_ort, self._session.inner_session, stacked
+                    )
+                for i, (_, future) in enumerate(batch):
+                    if not future.done():
+                        future.set_result(preds[i])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Lifespan context manager for startup and shutdown events
     """
-    global model_session
+    global model_session, batch_queue
 
     # Startup: Load rembg model once
     logger.info("🚀 Starting up: Loading rembg model...")
     try:
         # Disable gradient tracking to save memory
         torch.set_grad_enabled(False)
-        model_session = new_session("u2netp")
+        model_session = build_model_session()
 
-        # If the session exposes a model attribute, put it in eval mode
+        # Pre-warm with a dummy frame so the first real request doesn't
+        # pay graph-JIT / allocator cost
         try:
-            if hasattr(model_session, "model") and model_session.model is not None:
-                model_session.model.eval()
+            model_session.predict(Image.new("RGB", MODEL_INPUT_SIZE))
+            logger.info("🔥 Model pre-warmed")
         except Exception:
-            # non-fatal: continue even if we can't set eval()
-            logger.debug("Could not call model_session.model.eval(); continuing.")
+            # non-fatal: first request will just be slower
+            logger.debug("Pre-warm inference failed; continuing.")
 
         logger.info("✅ Model loaded successfully")
     except Exception as e:
         logger.error(f"❌ Failed to load model: {e}")
         raise
 
+    # Start the request-batching queue in front of the session
+    batch_queue = AsyncBatchQueue(model_session)
+    batch_queue.start()
+    logger.info("✅ Batch queue started")
+
     yield
 
     # Shutdown: Cleanup
     logger.info("🛑 Shutting down gracefully...")
+    if batch_queue is not None:
+        await batch_queue.stop()
+        batch_queue = None
     model_session = None
     # force a GC on shutdown
     try:
@@ -106,23 +536,23 @@ def validate_image(file: UploadFile) -> None:
     """
     Validate uploaded file type and size
     """
-    # Check content type (relaxed for common formats)
-    if file.content_type and file.content_type not in ALLOWED_EXTENSIONS:
-        # Try to validate by file extension if content type check fails
-        if not any(file.filename.lower().endswith(ext) for ext in [
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff',
-            '.tif', '.webp', '.ico', '.avif', '.heic', '.heif',
-            '.tga', '.pcx', '.ppm', '.pgm', '.pbm', '.pnm'
-        ]):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type. Supported formats: JPEG, PNG, GIF, BMP, TIFF, WebP, ICO, AVIF, and more"
-            )
+    # Check content type (relaxed for common formats), falling back to
+    # the filename suffix when the header is off
+    if (file.content_type and file.content_type not in ALLOWED_EXTENSIONS
+            and not (file.filename or "").lower().endswith(_ALLOWED_SUFFIXES)):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Supported formats: JPEG, PNG, GIF, BMP, TIFF, WebP, ICO, AVIF, and more"
+        )
 
-    # Check file size
-    file.file.seek(0, 2)  # Seek to end
-    file_size = file.file.tell()
-    file.file.seek(0)  # Reset to beginning
+    # Check file size — Starlette already tracked it while parsing, so
+    # no need to force the SpooledTemporaryFile through a seek/tell pair
+    file_size = file.size
+    if file_size is None:
+        # Older Starlette without UploadFile.size: fall back to seeking
+        file.file.seek(0, 2)
+        file_size = file.file.tell()
+        file.file.seek(0)
 
     if file_size > MAX_FILE_SIZE:
         raise HTTPException(
@@ -137,55 +567,280 @@ def validate_image(file: UploadFile) -> None:
         )
 
 
-async def process_image(file_content: bytes) -> bytes:
+class BufferPool:
+    """
+    Small pool of reusable, pre-sized output buffers for PNG encoding.
+
+    Avoids churning the GC with a fresh megabyte-scale allocation per
+    request. Buffers are handed out at full capacity and never cleared
+    on release — _ByteArrayWriter tracks the logical length itself, so
+    the capacity genuinely survives between uses (bytearray.clear()
+    would reallocate it away).
+    """
+
+    def __init__(self, max_buffers: int = 8, initial_size: int = BUFFER_INITIAL_SIZE):
+        self._buffers: deque = deque()
+        self._lock = asyncio.Lock()
+        self._max_buffers = max_buffers
+        self._initial_size = initial_size
+
+    async def acquire(self) -> bytearray:
+        async with self._lock:
+            if self._buffers:
+                return self._buffers.popleft()
+        return bytearray(self._initial_size)
+
+    async def release(self, buffer: bytearray) -> None:
+        async with self._lock:
+            if len(self._buffers) < self._max_buffers:
+                self._buffers.append(buffer)
+
+
+# Shared pool for PNG output buffers
+output_buffer_pool = BufferPool()
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of finished PNGs keyed by the SHA-256 of the
+    upload.
+
+    Hashing the body is essentially free next to the UNet (SHA-NI on
+    modern CPUs), so identical re-uploads and idempotent retries skip
+    the whole pipeline. Eviction is O(1) from the cold end.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self._entries: OrderedDict = OrderedDict()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._total_bytes = 0
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: bytes, value: bytes) -> None:
+        if len(value) > self._max_bytes:
+            return
+        if key in self._entries:
+            self._total_bytes -= len(self._entries.pop(key))
+        self._entries[key] = value
+        self._total_bytes += len(value)
+        while len(self._entries) > self._max_entries or self._total_bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted)
+
+
+# Shared cache of processed results
+result_cache = ResultCache()
+
+
+class _ByteArrayWriter:
+    """
+    Minimal file-like adapter so PIL can save straight into a pooled
+    bytearray without an intermediate BytesIO.
+
+    Writes overwrite the pre-sized buffer in place and track the
+    logical length separately, so the pooled capacity is reused rather
+    than appended to (and never released on reuse).
+    """
+
+    __slots__ = ("_buffer", "_pos")
+
+    def __init__(self, buffer: bytearray):
+        self._buffer = buffer
+        self._pos = 0
+
+    def write(self, data) -> int:
+        n = len(data)
+        end = self._pos + n
+        if end > len(self._buffer):
+            try:
+                self._buffer.extend(bytes(end - len(self._buffer)))
+            except BufferError:
+                # A view of the pooled buffer is still exported; detach
+                # onto a private copy rather than failing the request
+                self._buffer = self._buffer[:self._pos] + bytes(end - self._pos)
+        self._buffer[self._pos:end] = data
+        self._pos = end
+        return n
+
+    def getvalue(self) -> memoryview:
+        return memoryview(self._buffer)[:self._pos]
+
+    def flush(self) -> None:
+        pass
+
+
+class _InMemoryMultiPartParser(MultiPartParser):
+    """
+    Multipart parser whose spool threshold sits above MAX_FILE_SIZE.
+
+    Starlette's default spills parsed files to /tmp past ~1MB, so a
+    10MB upload gets written to disk and read straight back — pure I/O
+    amplification. The body is capped anyway, so keep it in RAM.
+    """
+
+    max_file_size = MAX_FILE_SIZE + 4096
+    spool_max_size = MAX_FILE_SIZE + 4096  # older Starlette attribute name
+
+
+async def read_body_capped(request: Request) -> bytes:
+    """
+    Stream the raw request body into a size-capped buffer.
+
+    Rejects oversize uploads as soon as the cap is crossed instead of
+    reading (and copying) the whole body first.
+    """
+    buffer = bytearray()
+    async for chunk in request.stream():
+        buffer.extend(chunk)
+        if len(buffer) > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large. Maximum size: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+            )
+
+    if not buffer:
+        raise HTTPException(
+            status_code=400,
+            detail="Empty file uploaded"
+        )
+
+    return bytes(buffer)
+
+
+def iter_png_chunks(payload: Union[bytes, memoryview]):
+    """
+    Yield an encoded PNG as zero-copy memoryview slices.
+
+    Sending one giant chunk makes the ASGI server buffer the whole
+    payload again; fixed-size slices keep per-write cost flat and give
+    the client its first byte immediately.
+    """
+    view = memoryview(payload)
+    for start in range(0, len(view), RESPONSE_CHUNK_SIZE):
+        yield view[start:start + RESPONSE_CHUNK_SIZE]
+
+
+def encode_png(image: Union[Image.Image, np.ndarray],
+               out: Optional[bytearray] = None) -> Union[bytes, memoryview]:
+    """
+    Encode a PIL image or interleaved uint8 array to PNG bytes.
+
+    Uses fpnge when available — far faster than Pillow's zlib path on
+    RGBA output. Falls back to Pillow for unusual shapes or when fpnge
+    isn't installed; the fallback writes into `out` (a pooled
+    bytearray) when given, avoiding a fresh allocation.
+    """
+    arr = np.asarray(image)
+    if fpnge is not None:
+        # fpnge handles interleaved 8-bit RGB/RGBA
+        if arr.dtype == np.uint8 and arr.ndim == 3 and arr.shape[2] in (3, 4):
+            return fpnge.fromNP(np.ascontiguousarray(arr))
+
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(arr)
+
+    # compress_level=1: optimize=True ran a maximal filter search plus
+    # level-9 zlib — ~10x the encode time for ~10% smaller output
+    if out is not None:
+        writer = _ByteArrayWriter(out)
+        image.save(writer, format="PNG", compress_level=1)
+        return writer.getvalue()
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def _decode_and_normalize(file_content: bytes) -> Image.Image:
+    """
+    Decode the upload and normalize its mode for the model (sync,
+    CPU-bound — run under asyncio.to_thread).
+    """
+    # Open image (PIL auto-detects format)
+    input_image = Image.open(io.BytesIO(file_content))
+
+    # Force the (lazy) decode here, in this worker thread — otherwise
+    # the first pixel access downstream triggers it mid-pipeline
+    input_image.load()
+
+    # Apply the EXIF orientation, as rembg's remove() wrapper did —
+    # phone photos are routinely stored rotated
+    input_image = ImageOps.exif_transpose(input_image)
+
+    # Log image info
+    logger.info(f"Processing image: {input_image.format} {input_image.size} {input_image.mode}")
+
+    # Convert image mode if necessary for rembg compatibility
+    # rembg works best with RGB or RGBA images
+    if input_image.mode not in ('RGB', 'RGBA'):
+        input_image = _MODE_TO_RGB.get(input_image.mode, _default_to_rgb)(input_image)
+        logger.info(f"Converted image mode to: {input_image.mode}")
+
+    return input_image
+
+
+def _postprocess_and_encode(input_image: Image.Image, pred: np.ndarray,
+                            out: Optional[bytearray]) -> Union[bytes, memoryview]:
+    """
+    Turn a raw model output slice into the finished PNG (sync,
+    CPU-bound — run under asyncio.to_thread).
+    """
+    mask = mask_from_output(pred, input_image.size)
+    return _composite_and_encode(input_image, mask, out)
+
+
+def _composite_and_encode(input_image: Image.Image, mask: Image.Image,
+                          out: Optional[bytearray]) -> Union[bytes, memoryview]:
+    """
+    Paste a full-size alpha mask onto the input and encode to PNG
+    (sync, CPU-bound — run under asyncio.to_thread).
+
+    The composite is pure NumPy: copy the RGB planes and the resized
+    alpha into a preallocated RGBA array in two wide stores instead of
+    PIL's convert("RGBA") + putalpha pair (two extra full-size copies
+    and a scalar per-row loop).
+    """
+    rgb = np.asarray(input_image)
+    height, width = rgb.shape[0], rgb.shape[1]
+    output = np.empty((height, width, 4), dtype=np.uint8)
+    output[:, :, :3] = rgb[:, :, :3]  # drops any stale alpha on RGBA input
+    output[:, :, 3] = np.asarray(mask)
+    return encode_png(output, out=out)
+
+
+async def process_image(file_content: bytes, out: Optional[bytearray] = None) -> Union[bytes, memoryview]:
     """
     Process image and remove background - supports all PIL formats
+
+    The synchronous Pillow work (decode, preprocess, composite, encode)
+    runs in worker threads via asyncio.to_thread so the event loop
+    stays free to serve other requests while this one computes; the
+    model step goes through the batching queue. When `out` is given,
+    the Pillow encode fallback writes into it so the PNG lands in a
+    pooled buffer instead of a fresh allocation.
     """
-    # Define locals to be cleaned up in finally
     input_image = None
-    output_image = None
-    output_buffer = None
 
     try:
-        # Open image (PIL auto-detects format)
-        input_image = Image.open(io.BytesIO(file_content))
-
-        # Log image info
-        logger.info(f"Processing image: {input_image.format} {input_image.size} {input_image.mode}")
-
-        # Convert image mode if necessary for rembg compatibility
-        # rembg works best with RGB or RGBA images
-        if input_image.mode not in ('RGB', 'RGBA'):
-            if input_image.mode == 'P':  # Palette mode
-                # Check if image has transparency
-                if 'transparency' in input_image.info:
-                    input_image = input_image.convert('RGBA')
-                else:
-                    input_image = input_image.convert('RGB')
-            elif input_image.mode in ('L', 'LA'):  # Grayscale
-                if input_image.mode == 'LA':
-                    input_image = input_image.convert('RGBA')
-                else:
-                    input_image = input_image.convert('RGB')
-            elif input_image.mode == '1':  # Binary
-                input_image = input_image.convert('RGB')
-            elif input_image.mode == 'CMYK':
-                input_image = input_image.convert('RGB')
-            else:
-                # For any other mode, try converting to RGB
-                input_image = input_image.convert('RGB')
-
-            logger.info(f"Converted image mode to: {input_image.mode}")
-
-        # Remove background using preloaded model
-        output_image = remove(input_image, session=model_session)
+        input_image = await asyncio.to_thread(_decode_and_normalize, file_content)
 
-        # Convert to PNG with transparency
-        output_buffer = io.BytesIO()
-        output_image.save(output_buffer, format="PNG", optimize=True)
-        output_buffer.seek(0)
+        # Remove background: go through the batching queue so concurrent
+        # requests share one batched session.run
+        if batch_queue is not None:
+            tensor = await asyncio.to_thread(preprocess_for_model, input_image)
+            pred = await batch_queue.submit(tensor)
+            return await asyncio.to_thread(_postprocess_and_encode, input_image, pred, out)
 
-        return output_buffer.getvalue()
+        # Fallback (e.g. queue not started): single-image session.predict,
+        # skipping rembg's remove() wrapper and its PIL<->ndarray bouncing
+        masks = await asyncio.to_thread(model_session.predict, input_image)
+        return await asyncio.to_thread(_composite_and_encode, input_image, masks[0], out)
 
     except HTTPException:
         # re-raise HTTPException as-is
@@ -200,23 +855,7 @@ async def process_image(file_content: bytes) -> bytes:
         # Cleanup / free memory
         try:
             if input_image is not None:
-                try:
-                    input_image.close()
-                except Exception:
-                    pass
-                del input_image
-            if output_image is not None:
-                try:
-                    output_image.close()
-                except Exception:
-                    pass
-                del output_image
-            if output_buffer is not None:
-                try:
-                    output_buffer.close()
-                except Exception:
-                    pass
-                del output_buffer
+                input_image.close()
         except Exception:
             pass
         # Force garbage collection to free memory immediately
@@ -259,40 +898,110 @@ async def health_check():
 
 
 @app.post("/api/remove-bg")
-async def remove_background(file: UploadFile = File(...)):
+async def remove_background(request: Request):
     """
     Remove background from uploaded image
 
-    Supports all major image formats: JPEG, PNG, GIF, BMP, TIFF, WebP,
-    ICO, AVIF, HEIC, TGA, PCX, PPM, and more.
-
-    Args:
-        file: Uploaded image file (max 10MB)
+    Accepts either a multipart form upload (field name: file) or the
+    raw image bytes as the request body. Supports all major image
+    formats: JPEG, PNG, GIF, BMP, TIFF, WebP, ICO, AVIF, HEIC, TGA,
+    PCX, PPM, and more (max 10MB).
 
     Returns:
         Transparent PNG image stream
     """
-    logger.info(f"📥 Received request: {file.filename} ({file.content_type})")
+    content_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
 
     try:
-        # Validate file
-        validate_image(file)
+        # Early rejection on the declared size, before reading any body
+        # (small allowance on top of the cap for multipart framing)
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + 8192:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File too large. Maximum size: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
+            )
+
+        if content_type.startswith("multipart/"):
+            # Classic form upload path, parsed with the in-memory spool
+            try:
+                form = await _InMemoryMultiPartParser(request.headers, request.stream()).parse()
+            except MultiPartException as e:
+                # Malformed multipart (bad boundary, too many parts, ...)
+                # is a client error, as it was with request.form()
+                raise HTTPException(
+                    status_code=400,
+                    detail=getattr(e, "message", None) or "Invalid multipart body"
+                )
+            file = form.get("file")
+            if not isinstance(file, UploadFile):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Missing file field in form data"
+                )
+
+            logger.info(f"📥 Received request: {file.filename} ({file.content_type})")
+
+            validate_image(file)
+            file_content = await file.read()
+            filename = file.filename or "image"
+        else:
+            # Raw-body upload: validate via headers, stream with a size cap
+            logger.info(f"📥 Received raw-body request ({content_type or 'no content-type'})")
+
+            if content_type and content_type not in ALLOWED_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid file type. Supported formats: JPEG, PNG, GIF, BMP, TIFF, WebP, ICO, AVIF, and more"
+                )
+
+            file_content = await read_body_capped(request)
+            filename = "image"
+
+        # Short-circuit identical re-uploads straight from the cache
+        cache_key = hashlib.sha256(file_content).digest()
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Cache hit: {filename}")
+            return StreamingResponse(
+                iter_png_chunks(cached),
+                media_type="image/png",
+                headers={
+                    "Content-Disposition": f"attachment; filename=nobg_{filename.rsplit('.', 1)[0]}.png"
+                }
+            )
+
+        # A pooled output buffer only helps the Pillow fallback encoder;
+        # fpnge allocates its own output, so skip the pool round-trip
+        output_buffer = None
+        if fpnge is None:
+            output_buffer = await output_buffer_pool.acquire()
+
+        try:
+            output = await process_image(file_content, out=output_buffer)
+        except BaseException:
+            if output_buffer is not None:
+                await output_buffer_pool.release(output_buffer)
+            raise
 
-        # Read file content
-        file_content = await file.read()
+        # Cache the finished PNG (copy out of the pooled buffer)
+        result_cache.put(cache_key, output if isinstance(output, bytes) else bytes(output))
 
-        # Process image (remove background)
-        output_bytes = await process_image(file_content)
+        logger.info(f"✅ Successfully processed: {filename}")
 
-        logger.info(f"✅ Successfully processed: {file.filename}")
+        # Return as streaming response; any pooled buffer goes back to
+        # the pool once the response has been flushed
+        background = None
+        if output_buffer is not None:
+            background = BackgroundTask(output_buffer_pool.release, output_buffer)
 
-        # Return as streaming response
         return StreamingResponse(
-            io.BytesIO(output_bytes),
+            iter_png_chunks(output),
             media_type="image/png",
             headers={
-                "Content-Disposition": f"attachment; filename=nobg_{file.filename.rsplit('.', 1)[0]}.png"
-            }
+                "Content-Disposition": f"attachment; filename=nobg_{filename.rsplit('.', 1)[0]}.png"
+            },
+            background=background
         )
 
     except HTTPException:
@@ -340,5 +1049,7 @@ if __name__ == "__main__":
         port=port,
         reload=False,
         workers=1,  # limit to single worker to reduce memory duplication
+        loop="uvloop",  # libuv event loop: ~2x faster than stock asyncio
+        http="httptools",  # C HTTP parser to match
         log_level="info"
     )
\ No newline at end of file